@@ -0,0 +1,356 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+
+
+# main.py signs every request with AWS4Auth at import time, so give boto3
+# dummy credentials when none are configured. The fake cluster ignores them.
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "load-test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "load-test")
+
+import main
+
+
+
+
+# Answers that walk each path all the way to its final step
+YELLOW_PATH = [
+   ("yellow_troubleshooting_confirm", "yes"),
+   ("check_single_node", "yes"),
+   ("check_disk_space", "yes"),
+   ("check_jvm_cpu", "yes"),
+   ("check_replica_config", "yes"),
+   ("check_node_failures", "yes"),
+   ("check_newly_created_index", "yes"),
+   ("confirm_new_index_creation", "no"),
+   ("check_allocation_issues", "yes"),
+]
+
+# Yellow cluster after index creation: long-polls for GREEN, then hands off when recovery stalls
+YELLOW_NEW_INDEX_PATH = YELLOW_PATH[:7] + [
+   ("confirm_new_index_creation", "yes"),
+   ("wait_for_recovery", "yes"),
+   ("check_allocation_issues", "yes"),
+]
+
+RED_PATH = [
+   ("red_troubleshooting_confirm", "yes"),
+]
+
+
+
+
+class FakeOpenSearchHandler(BaseHTTPRequestHandler):
+   """Serves canned OpenSearch responses with injectable latency and errors"""
+
+   def do_GET(self):
+      fake = self.server
+      # Drain any request body (allocation explain sends one) so the connection stays usable
+      self.rfile.read(int(self.headers.get("Content-Length") or 0))
+      if fake.latency_ms or fake.jitter_ms:
+         time.sleep((fake.latency_ms + random.uniform(0, fake.jitter_ms)) / 1000)
+      if fake.error_rate and random.random() < fake.error_rate:
+         # Gateway-style failure with a non-JSON body, like an overloaded domain returns
+         self.send_response(503)
+         self.send_header("Content-Length", "0")
+         self.end_headers()
+         return
+
+      # Cluster name is the first path segment, e.g. /red-0/_cluster/health
+      url = urlparse(self.path)
+      parts = url.path.strip("/").split("/", 1)
+      scenario = "red" if parts[0].startswith("red") else "yellow"
+      api = parts[1] if len(parts) > 1 else ""
+      if api.startswith("_cluster/health"):
+         api = "_cluster/health"  # Per-index health gets the cluster-wide answer
+      body = fake.responses(scenario).get(api)
+      if body is None:
+         self._send_json(404, {"error": f"no fake response for '{api}'"})
+      elif api == "_cluster/health" and parse_qs(url.query).get("wait_for_status", [scenario])[0] != scenario:
+         # Like OpenSearch: a wait that isn't met answers 408 with timed_out. The fake doesn't hold the request open.
+         self._send_json(408, dict(body, timed_out=True))
+      else:
+         self._send_json(200, body)
+
+   def _send_json(self, status, body):
+      payload = json.dumps(body).encode()
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(payload)))
+      self.end_headers()
+      self.wfile.write(payload)
+
+   def log_message(self, format, *args):
+      pass
+
+
+
+
+class FakeOpenSearch(ThreadingHTTPServer):
+   """Local stand-in for an OpenSearch domain, one scenario per cluster name prefix"""
+
+   daemon_threads = True
+   request_queue_size = 128  # Fan-out bursts overflow the default backlog of 5
+
+   def __init__(self, port=0, node_count=3, index_count=50, unassigned_primaries=20, latency_ms=0, jitter_ms=0, error_rate=0.0):
+      super().__init__(("127.0.0.1", port), FakeOpenSearchHandler)
+      self.node_count = node_count
+      self.index_count = index_count
+      self.unassigned_primaries = unassigned_primaries
+      self.latency_ms = latency_ms
+      self.jitter_ms = jitter_ms
+      self.error_rate = error_rate
+      self._responses = {scenario: self._build_responses(scenario) for scenario in ("yellow", "red")}
+
+   @property
+   def endpoint(self):
+      return f"http://127.0.0.1:{self.server_address[1]}"
+
+   def responses(self, scenario):
+      return self._responses[scenario]
+
+   def _build_responses(self, scenario):
+      nodes_fs = {}
+      nodes_jvm = {}
+      for i in range(self.node_count):
+         nodes_fs[f"node-{i}"] = {
+            "name": f"node-{i}",
+            "fs": {"total": {"total_in_bytes": 100 * 1024**3, "available_in_bytes": 60 * 1024**3}}
+         }
+         nodes_jvm[f"node-{i}"] = {
+            "name": f"node-{i}",
+            "jvm": {
+               "mem": {"heap_used_percent": 45},
+               "gc": {"collectors": {
+                  "old": {"collection_count": 3, "collection_time_in_millis": 120},
+                  "young": {"collection_count": 400, "collection_time_in_millis": 5000}
+               }}
+            },
+            "os": {"cpu": {"percent": 30}}
+         }
+
+      indices = [
+         {"health": scenario, "status": "open", "index": f"logs-{i:05d}", "uuid": f"uuid-{i:05d}", "pri": "5", "rep": "1",
+          "docs.count": "1000", "store.size": "10mb", "creation.date": "1700000000000"}
+         for i in range(self.index_count)
+      ]
+
+      health = {
+         "cluster_name": f"{scenario}-cluster",
+         "status": scenario,
+         "number_of_nodes": self.node_count,
+         "number_of_data_nodes": self.node_count,
+         "active_primary_shards": self.index_count * 5,
+         "unassigned_shards": 5,
+         "initializing_shards": 0,
+         "active_shards_percent_as_number": 98.0,
+         "timed_out": False,
+         "indices": {index["index"]: {"status": scenario} for index in indices[:1]},
+      }
+
+      # Red clusters lose a primary per index, starting with the first index
+      shards = []
+      for i, index in enumerate(indices):
+         lost = scenario == "red" and i < self.unassigned_primaries
+         shards.append({"index": index["index"], "shard": "0", "prirep": "p", "state": "UNASSIGNED" if lost else "STARTED"})
+         shards.append({"index": index["index"], "shard": "0", "prirep": "r", "state": "STARTED" if scenario == "red" else "UNASSIGNED"})
+
+      explain = {
+         "current_state": "unassigned",
+         "unassigned_info": {"reason": "NODE_LEFT"},
+         "can_allocate": "no_valid_shard_copy",
+         "allocate_explanation": "cannot allocate because a previous copy of the primary shard existed but can no longer be found on the nodes in the cluster",
+         "node_allocation_decisions": [
+            {"node_name": f"node-{i}", "node_decision": "no"} for i in range(self.node_count)
+         ]
+      }
+
+      return {
+         "_cluster/state/version": {"cluster_name": f"{scenario}-cluster", "state_uuid": f"{scenario}-state", "version": 1},
+         "_cluster/health": health,
+         "_cat/indices": indices,
+         "_cat/shards": shards,
+         "_cluster/allocation/explain": explain,
+         "_nodes/stats/fs": {"nodes": nodes_fs},
+         "_nodes/stats/jvm,os": {"nodes": nodes_jvm},
+      }
+
+
+
+
+def build_lex_event(cluster_name, user_input, session_attrs):
+   """Build a Lex V2 fulfillment event for one conversation turn"""
+   return {
+      "inputTranscript": user_input,
+      "sessionState": {
+         "sessionAttributes": dict(session_attrs),
+         "intent": {
+            "name": "DiagnoseClusterIntent",
+            "slots": {
+               "ClusterName": {"value": {"interpretedValue": cluster_name}},
+               "UserResponse": None
+            }
+         }
+      }
+   }
+
+
+
+
+def run_session(cluster_name, path):
+   """Drive one conversation through lambda_handler, returning (step, seconds, ok) per turn"""
+   turns = [("initial", cluster_name)] + path
+   session_attrs = {}
+   results = []
+
+   for expected_step, user_input in turns:
+      event = build_lex_event(cluster_name, user_input, session_attrs)
+      start = time.perf_counter()
+      response = main.lambda_handler(event, None)
+      elapsed = time.perf_counter() - start
+
+      session_state = response.get("sessionState", {})
+      ok = session_state.get("intent", {}).get("state") != "Failed"
+      current_step = session_attrs.get("step", "initial")
+      ok = ok and current_step == expected_step
+      results.append((expected_step, elapsed, ok))
+
+      if not ok or session_state.get("dialogAction", {}).get("type") == "Close":
+         break
+      session_attrs = session_state.get("sessionAttributes", {})
+
+   return results
+
+
+
+
+def percentile(sorted_values, pct):
+   """Nearest-rank percentile of an already sorted list"""
+   if not sorted_values:
+      return 0.0
+   rank = math.ceil(pct / 100 * len(sorted_values))
+   return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+
+
+def summarize(all_results, wall_seconds, session_count):
+   """Build the per-step latency, throughput and failure-rate report"""
+   by_step = {}
+   for step, elapsed, ok in all_results:
+      entry = by_step.setdefault(step, {"latencies": [], "failures": 0})
+      entry["latencies"].append(elapsed)
+      if not ok:
+         entry["failures"] += 1
+
+   lines = [f"{'step':<32}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'fail %':>9}"]
+   step_order = ["initial"]
+   for step, _ in YELLOW_NEW_INDEX_PATH + YELLOW_PATH + RED_PATH:
+      if step not in step_order:
+         step_order.append(step)
+   for step in sorted(by_step, key=lambda s: step_order.index(s) if s in step_order else len(step_order)):
+      latencies = sorted(by_step[step]["latencies"])
+      count = len(latencies)
+      fail_pct = by_step[step]["failures"] / count * 100
+      lines.append(
+         f"{step:<32}{count:>7}"
+         f"{percentile(latencies, 50) * 1000:>10.1f}"
+         f"{percentile(latencies, 95) * 1000:>10.1f}"
+         f"{percentile(latencies, 99) * 1000:>10.1f}"
+         f"{fail_pct:>8.1f}%"
+      )
+
+   total_turns = len(all_results)
+   total_failures = sum(1 for _, _, ok in all_results if not ok)
+   failure_rate = total_failures / total_turns * 100 if total_turns else 0.0
+   lines.append("")
+   lines.append(f"sessions: {session_count}  turns: {total_turns}  wall time: {wall_seconds:.2f}s")
+   lines.append(f"throughput: {total_turns / wall_seconds:.1f} turns/s, {session_count / wall_seconds:.1f} sessions/s")
+   lines.append(f"failure rate: {failure_rate:.2f}% ({total_failures} failed turns)")
+   return "\n".join(lines)
+
+
+
+
+def run_load(sessions, concurrency, red_ratio, new_index_ratio, fake):
+   """Run many sessions concurrently against the fake cluster and return the report"""
+   clusters = {}
+   plan = []
+   for i in range(sessions):
+      scenario = "red" if random.random() < red_ratio else "yellow"
+      cluster_name = f"{scenario}-{i % concurrency}"
+      clusters[cluster_name] = f"{fake.endpoint}/{cluster_name}"
+      if scenario == "red":
+         path = RED_PATH
+      elif random.random() < new_index_ratio:
+         path = YELLOW_NEW_INDEX_PATH
+      else:
+         path = YELLOW_PATH
+      plan.append((cluster_name, path))
+
+   main.CLUSTER_ENDPOINTS.clear()
+   main.CLUSTER_ENDPOINTS.update(clusters)
+
+   all_results = []
+   start = time.perf_counter()
+   with ThreadPoolExecutor(max_workers=concurrency) as pool:
+      for results in pool.map(lambda item: run_session(*item), plan):
+         all_results.extend(results)
+   wall_seconds = time.perf_counter() - start
+
+   return summarize(all_results, wall_seconds, sessions)
+
+
+
+
+def main_cli():
+   parser = argparse.ArgumentParser(description="Load-test lambda_handler with multi-turn Lex V2 sessions against a fake OpenSearch")
+   parser.add_argument("--sessions", type=int, default=200, help="total conversations to run")
+   parser.add_argument("--concurrency", type=int, default=20, help="conversations in flight at once")
+   parser.add_argument("--red-ratio", type=float, default=0.2, help="fraction of sessions that take the red path")
+   parser.add_argument("--new-index-ratio", type=float, default=0.3, help="fraction of yellow sessions that confirm a new index and wait for GREEN")
+   parser.add_argument("--nodes", type=int, default=3, help="nodes reported by the fake cluster")
+   parser.add_argument("--indices", type=int, default=50, help="indices reported by _cat/indices")
+   parser.add_argument("--unassigned-primaries", type=int, default=20, help="unassigned primary shards on red clusters")
+   parser.add_argument("--latency-ms", type=float, default=20, help="base latency added to every fake OpenSearch call")
+   parser.add_argument("--jitter-ms", type=float, default=10, help="random extra latency per call")
+   parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake OpenSearch calls that return HTTP 503")
+   parser.add_argument("--verbose", action="store_true", help="keep lambda_handler's DEBUG output")
+   args = parser.parse_args()
+
+   fake = FakeOpenSearch(
+      node_count=args.nodes,
+      index_count=args.indices,
+      unassigned_primaries=args.unassigned_primaries,
+      latency_ms=args.latency_ms,
+      jitter_ms=args.jitter_ms,
+      error_rate=args.error_rate
+   )
+   threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+   try:
+      if args.verbose:
+         report = run_load(args.sessions, args.concurrency, args.red_ratio, args.new_index_ratio, fake)
+      else:
+         with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = run_load(args.sessions, args.concurrency, args.red_ratio, args.new_index_ratio, fake)
+   finally:
+      fake.shutdown()
+
+   print(report)
+
+
+
+
+if __name__ == "__main__":
+   main_cli()
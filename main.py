@@ -1,5 +1,17 @@
+import cProfile
+import functools
+import io
 import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, wait
 import requests
+from requests.adapters import HTTPAdapter
 from requests_aws4auth import AWS4Auth
 import boto3
 
@@ -17,47 +29,223 @@ region = "us-east-1"  # Update to your AWS region
 service = "es"
 
 
+# Long-polling for GREEN must finish before Lambda (and Lex) give up on us
+WAIT_FOR_GREEN_MAX_SECONDS = 25
+LAMBDA_SAFETY_MARGIN_MS = 3000
+HEALTH_RESPONSE_GRACE_SECONDS = 2  # Kept out of each server-side wait so the response arrives in time
+MAX_WAIT_INDICES = 50
 
 
+# Allocation-explain fan-out for RED clusters (one explain call per unassigned primary).
+# One pool per process bounds explain calls across invocations; each cluster gets a share of it.
+EXPLAIN_POOL_WORKERS = 32
+EXPLAIN_MAX_CONCURRENCY = 16  # In-flight explain calls per cluster
+EXPLAIN_MAX_SECONDS = 20
+EXPLAIN_MAX_SHARDS = 500
+EXPLAIN_MAX_GROUPS = 8
+
+
+# Replica check: how many misconfigured indices to name in the reply
+REPLICA_REPORT_MAX_INDICES = 10
+
+
+# Opt-in profiling: e.g. PROFILE_SAMPLE_RATE=0.01 profiles 1% of invocations
+def read_profile_sample_rate():
+   """Read PROFILE_SAMPLE_RATE, disabling profiling rather than failing on a bad value"""
+   value = os.environ.get("PROFILE_SAMPLE_RATE", "0")
+   try:
+       return float(value)
+   except ValueError:
+       print(f"ERROR: Invalid PROFILE_SAMPLE_RATE '{value}', profiling disabled")
+       return 0.0
+
+
+PROFILE_SAMPLE_RATE = read_profile_sample_rate()
+PROFILE_OUTPUT_DIR = os.environ.get("PROFILE_OUTPUT_DIR", "")  # e.g. /tmp, empty = logs only
+PROFILE_TOP_N = 15
+_profile_lock = threading.Lock()
+# Largest allocation snapshot seen at a checkpoint during the invocation being profiled.
+# Only the profiled invocation's thread takes checkpoints; overhead_ms is time spent snapshotting.
+_profile_peak = {"thread": None, "profiler": None, "size": 0, "snapshot": None, "overhead_ms": 0.0}
+_profile_peak_lock = threading.Lock()
+
+
+
+
+# Refreshable so long-running processes (server.py) keep signing with fresh STS credentials
 credentials = boto3.Session().get_credentials()
-awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, region, service, session_token=credentials.token)
+awsauth = AWS4Auth(refreshable_credentials=credentials, region=region, service=service)
+
+
+# One pooled session shared by every request, so warm Lambdas and server.py reuse connections
+http_session = requests.Session()
+
+
+
+
+def configure_http_pool(handler_workers):
+   """Size the connection pool for every thread that can call OpenSearch at once"""
+   # Each handler thread makes one call at a time; allocation-explain adds up to EXPLAIN_POOL_WORKERS more.
+   # pool_connections is how many per-host pools are kept, so every cluster keeps its own warm pool.
+   http_adapter = HTTPAdapter(
+       pool_connections=max(len(CLUSTER_ENDPOINTS), 10),
+       pool_maxsize=handler_workers + EXPLAIN_POOL_WORKERS
+   )
+   http_session.mount("https://", http_adapter)
+   http_session.mount("http://", http_adapter)
 
 
+configure_http_pool(1)  # A Lambda container handles one invocation at a time
 
 
+
+
+def profile_checkpoint(func):
+   """While an invocation is profiled, snapshot allocations when func returns at a new memory high"""
+   @functools.wraps(func)
+   def wrapper(*args, **kwargs):
+       result = func(*args, **kwargs)
+       # The result (usually a parsed OpenSearch response) is still alive here, so it shows up in the snapshot
+       if _profile_peak["thread"] == threading.get_ident():
+           with _profile_peak_lock:
+               current, _ = tracemalloc.get_traced_memory()
+               if current > _profile_peak["size"]:
+                   # Keep the snapshot itself out of the profiled timings
+                   _profile_peak["profiler"].disable()
+                   start = time.perf_counter()
+                   _profile_peak["size"] = current
+                   _profile_peak["snapshot"] = tracemalloc.take_snapshot()
+                   _profile_peak["overhead_ms"] += (time.perf_counter() - start) * 1000
+                   _profile_peak["profiler"].enable()
+       return result
+  
+   return wrapper
+
+
+
+
+@profile_checkpoint
 def get_cluster_health(domain_endpoint):
    url = f"{domain_endpoint}/_cluster/health"
-   response = requests.get(url, auth=awsauth)
+   response = http_session.get(url, auth=awsauth)
    return response.json()
 
 
 
 
+@profile_checkpoint
 def get_indices(domain_endpoint):
    url = f"{domain_endpoint}/_cat/indices?format=json"
-   response = requests.get(url, auth=awsauth)
+   response = http_session.get(url, auth=awsauth)
+   return response.json()
+
+
+
+
+def get_cluster_state_version(domain_endpoint):
+   """Get the cluster state version, or None if it can't be read (e.g. access denied)
+
+   The version changes on any cluster state change, including shard moves, not just index
+   metadata changes. On a YELLOW or recovering cluster it changes between most runs.
+   """
+   url = f"{domain_endpoint}/_cluster/state/version"
+   response = http_session.get(url, auth=awsauth)
+   if response.status_code != 200:
+       print(f"DEBUG - Cluster state version unavailable (HTTP {response.status_code})")
+       return None
+   state = response.json()
+   if "version" not in state or "state_uuid" not in state:
+       return None
+   return f"{state['state_uuid']}:{state['version']}"
+
+
+
+
+def get_index_settings(domain_endpoint):
+   """Get replicas, primary shards and creation date for every index"""
+   url = f"{domain_endpoint}/_cat/indices?format=json&h=index,uuid,pri,rep,creation.date"
+   response = http_session.get(url, auth=awsauth)
+   response.raise_for_status()
    return response.json()
 
 
 
 
+def get_non_green_indices(domain_endpoint, timeout=None):
+   """Get the names of indices that are not GREEN yet"""
+   url = f"{domain_endpoint}/_cluster/health?level=indices"
+   response = http_session.get(url, auth=awsauth, timeout=timeout)
+   indices = response.json().get("indices", {})
+   return [name for name, data in indices.items() if data.get("status") != "green"]
+
+
+
+
+def wait_for_green(domain_endpoint, deadline, indices=None):
+   """Long-poll cluster (or per-index) health until GREEN or the deadline, None if health can't be read"""
+   remaining = deadline - time.monotonic()
+   wait_seconds = max(int(remaining - HEALTH_RESPONSE_GRACE_SECONDS), 0)
+   url = f"{domain_endpoint}/_cluster/health"
+   params = {"wait_for_status": "green", "timeout": f"{wait_seconds}s"}
+   if indices:
+       url = f"{url}/{','.join(indices)}"
+       params["wait_for_active_shards"] = "all"
+   http_timeout = max(remaining, HEALTH_RESPONSE_GRACE_SECONDS)
+   response = http_session.get(url, auth=awsauth, params=params, timeout=http_timeout)
+   # OpenSearch answers 408 with the current health when the wait times out; anything
+   # else (e.g. 404 for an index deleted since the last turn) is an error body, not health
+   if response.status_code not in (200, 408):
+       print(f"DEBUG - Health wait on {url} failed with HTTP {response.status_code}")
+       return None
+   return response.json()
+
+
+
+
+def get_unassigned_primaries(domain_endpoint):
+   """Get (index, shard) for every unassigned primary shard"""
+   url = f"{domain_endpoint}/_cat/shards?format=json&h=index,shard,prirep,state"
+   response = http_session.get(url, auth=awsauth)
+   response.raise_for_status()
+   return [
+       (shard["index"], int(shard["shard"]))
+       for shard in response.json()
+       if shard.get("prirep") == "p" and shard.get("state") == "UNASSIGNED"
+   ]
+
+
+
+
+def explain_shard_allocation(domain_endpoint, index, shard, timeout_seconds):
+   """Ask OpenSearch why one primary shard is unassigned"""
+   url = f"{domain_endpoint}/_cluster/allocation/explain"
+   body = {"index": index, "shard": shard, "primary": True}
+   response = http_session.get(url, auth=awsauth, json=body, timeout=timeout_seconds)
+   return response.json()
+
+
+
+
+@profile_checkpoint
 def get_node_stats(domain_endpoint):
    url = f"{domain_endpoint}/_nodes/stats/fs"
-   response = requests.get(url, auth=awsauth)
+   response = http_session.get(url, auth=awsauth)
    return response.json()
 
 
 
 
+@profile_checkpoint
 def get_node_jvm_stats(domain_endpoint):
    """Get JVM and CPU statistics from OpenSearch nodes"""
    url = f"{domain_endpoint}/_nodes/stats/jvm,os"
-   response = requests.get(url, auth=awsauth)
+   response = http_session.get(url, auth=awsauth)
    return response.json()
 
 
 
 
+@profile_checkpoint
 def analyze_jvm_cpu_metrics(domain_endpoint):
    """Analyze JVM heap usage and CPU metrics"""
    stats = get_node_jvm_stats(domain_endpoint)
@@ -99,6 +287,7 @@ def analyze_jvm_cpu_metrics(domain_endpoint):
 
 
 
+@profile_checkpoint
 def analyze_disk_space(domain_endpoint):
    stats = get_node_stats(domain_endpoint)
    low_disk_nodes = []
@@ -126,6 +315,114 @@ def analyze_disk_space(domain_endpoint):
 
 
 
+class IndexSettingsIndex:
+   """Per-cluster index -> (replicas, shards, creation date), with aggregates kept up to date on every change"""
+  
+   def __init__(self):
+       self.lock = threading.Lock()
+       self.state_version = None
+       self.indices = {}
+       # Indices and total primaries bucketed by replica count, so node-count queries touch only a few buckets
+       self.names_by_replicas = {}
+       self.primaries_by_replicas = {}
+  
+   def _add(self, name, settings):
+       replicas, shards, _, _ = settings
+       self.indices[name] = settings
+       self.names_by_replicas.setdefault(replicas, set()).add(name)
+       self.primaries_by_replicas[replicas] = self.primaries_by_replicas.get(replicas, 0) + shards
+  
+   def _remove(self, name):
+       replicas, shards, _, _ = self.indices.pop(name)
+       bucket = self.names_by_replicas[replicas]
+       bucket.discard(name)
+       self.primaries_by_replicas[replicas] -= shards
+       if not bucket:
+           del self.names_by_replicas[replicas]
+           del self.primaries_by_replicas[replicas]
+  
+   def refresh(self, domain_endpoint):
+       """Apply index changes since the last run; returns how many indices changed
+
+       The index listing is skipped only when the cluster state version is unchanged. Shard
+       movement also bumps that version, so on a YELLOW cluster the listing usually still runs;
+       the saving there is that only changed indices touch the buckets.
+       """
+       with self.lock:
+           version = get_cluster_state_version(domain_endpoint)
+           if version is not None and version == self.state_version:
+               return 0
+          
+           changed = 0
+           seen = set()
+           for idx in get_index_settings(domain_endpoint):
+               try:
+                   settings = (int(idx["rep"]), int(idx["pri"]), idx.get("creation.date"), idx.get("uuid"))
+               except (KeyError, ValueError, TypeError):
+                   # Skip indices with missing or invalid shard settings (e.g. closed indices)
+                   continue
+               name = idx["index"]
+               seen.add(name)
+               if self.indices.get(name) != settings:
+                   if name in self.indices:
+                       self._remove(name)
+                   self._add(name, settings)
+                   changed += 1
+          
+           for name in self.indices.keys() - seen:
+               self._remove(name)
+               changed += 1
+          
+           # Stays None when the version can't be read, so the next run lists indices again
+           self.state_version = version
+           return changed
+  
+   def max_replicas(self):
+       with self.lock:
+           return max(self.names_by_replicas, default=0)
+  
+   def indices_needing_more_nodes(self, node_count, limit):
+       """Count and up to `limit` names of indices with more replicas than the other nodes can hold"""
+       with self.lock:
+           replica_counts = sorted((r for r in self.names_by_replicas if r >= node_count), reverse=True)
+           count = sum(len(self.names_by_replicas[replicas]) for replicas in replica_counts)
+           sample = []
+           for replicas in replica_counts:
+               for name in self.names_by_replicas[replicas]:
+                   if len(sample) >= limit:
+                       break
+                   sample.append((name, replicas))
+           return count, sample
+  
+   def unplaceable_replica_shards(self, node_count):
+       """Replica shards that can't be placed: each shard copy needs its own node"""
+       with self.lock:
+           return sum(
+               primaries * (replicas - (node_count - 1))
+               for replicas, primaries in self.primaries_by_replicas.items()
+               if replicas >= node_count
+           )
+
+
+
+
+# Kept across warm invocations (and requests in server.py), keyed by cluster endpoint
+index_settings_cache = {}
+_index_settings_cache_lock = threading.Lock()
+
+
+
+
+def get_index_settings_index(domain_endpoint):
+   """Get this cluster's index-settings index, brought up to date with any index changes"""
+   with _index_settings_cache_lock:
+       settings_index = index_settings_cache.setdefault(domain_endpoint, IndexSettingsIndex())
+   settings_index.refresh(domain_endpoint)
+   return settings_index
+
+
+
+
 def get_user_response(event):
    """Extract user's response from different possible input sources"""
    # Get from inputTranscript (user's actual message)
@@ -218,7 +515,263 @@ def handle_initial_request(cluster_name, domain_endpoint):
 
 
 
-def handle_troubleshooting_steps(step, user_response, session_data, domain_endpoint):
+def get_time_budget_seconds(context, max_seconds):
+   """Seconds we can spend waiting on OpenSearch without running out of Lambda time"""
+   budget = max_seconds
+   if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+       remaining = (context.get_remaining_time_in_millis() - LAMBDA_SAFETY_MARGIN_MS) // 1000
+       budget = min(budget, remaining)
+   return max(int(budget), 0)
+
+
+
+
+def check_recovery_progress(session_data, domain_endpoint, context):
+   """Wait for new-index replication to finish, or return a resumable 'still recovering' state"""
+   cluster_name = session_data["cluster_name"]
+   # One deadline for the whole turn; every call below only gets what is left of it
+   deadline = time.monotonic() + get_time_budget_seconds(context, WAIT_FOR_GREEN_MAX_SECONDS)
+  
+   # Session attributes must be strings, so the indices we wait on are kept comma-joined
+   if "recovering_indices" in session_data:
+       indices = [name for name in session_data["recovering_indices"].split(",") if name]
+   else:
+       indices = get_non_green_indices(domain_endpoint, timeout=max(deadline - time.monotonic(), HEALTH_RESPONSE_GRACE_SECONDS))
+       if len(indices) > MAX_WAIT_INDICES:
+           indices = []  # Too many to list in the URL, wait on the whole cluster instead
+  
+   health = wait_for_green(domain_endpoint, deadline, indices)
+   if health is None and indices:
+       # Some of the indices we were waiting on are gone, so wait on the ones still recovering
+       indices = get_non_green_indices(domain_endpoint, timeout=max(deadline - time.monotonic(), HEALTH_RESPONSE_GRACE_SECONDS))
+       if len(indices) > MAX_WAIT_INDICES:
+           indices = []
+       health = wait_for_green(domain_endpoint, deadline, indices)
+  
+   if health is None:
+       message = """⚠️ I couldn't read the recovery progress from the cluster health API.
+
+
+
+
+Let's move to the final step: checking for other allocation issues.
+
+
+
+
+Would you like me to proceed? (Y/N)"""
+      
+       return {
+           "message": message,
+           "next_step": "check_allocation_issues",
+           "session_data": session_data
+       }
+  
+   status = str(health.get("status", "unknown")).upper()
+  
+   if status == "GREEN" and not health.get("timed_out", False):
+       # Green for the waited-on indices says nothing about the rest of the cluster
+       cluster_health = wait_for_green(domain_endpoint, time.monotonic()) if indices else health
+       cluster_status = str((cluster_health or {}).get("status", "unknown")).upper()
+      
+       if cluster_status == "GREEN":
+           message = f"""✅ Replication has finished!
+
+
+
+
+Cluster '{cluster_name}' is back to GREEN. All replica shards for the new indices are allocated.
+
+
+
+
+The YELLOW status was caused by recent index creation. This is normal behavior and not a cause for concern."""
+          
+           return {
+               "message": message,
+               "next_step": "complete",
+               "session_data": session_data
+           }
+      
+       unassigned = (cluster_health or {}).get("unassigned_shards", "unknown")
+       message = f"""✅ Replication has finished for the new indices.
+
+
+
+
+Cluster '{cluster_name}' is still {cluster_status} though, with {unassigned} unassigned shards on other indices. Recent index creation doesn't explain those.
+
+
+
+
+Let's move to the final step: checking for other allocation issues.
+
+
+
+
+Would you like me to proceed? (Y/N)"""
+      
+       return {
+           "message": message,
+           "next_step": "check_allocation_issues",
+           "session_data": session_data
+       }
+  
+   initializing = int(health.get("initializing_shards", 0))
+   shards_left = int(health.get("unassigned_shards", 0)) + initializing
+   active_percent = float(health.get("active_shards_percent_as_number", 0))
+   previous_left = session_data.get("shards_left")
+  
+   # A large replica can copy for several checks without the count moving, so only a
+   # count that isn't dropping with nothing initializing is treated as a stall
+   if previous_left is not None and shards_left >= int(previous_left) and initializing == 0:
+       message = f"""⚠️ Replication is not making progress.
+
+
+
+
+{shards_left} shards are still not allocated ({active_percent:.1f}% of shards active) and none are being copied, the same as last time I checked.
+
+
+
+
+This no longer looks like normal new-index replication. Let's move to the final step: checking for other allocation issues.
+
+
+
+
+Would you like me to proceed? (Y/N)"""
+      
+       return {
+           "message": message,
+           "next_step": "check_allocation_issues",
+           "session_data": session_data
+       }
+  
+   progress_text = ""
+   if previous_left is not None and shards_left < int(previous_left):
+       progress_text = f" ({int(previous_left) - shards_left} allocated since the last check)"
+   elif initializing:
+       progress_text = f" ({initializing} being copied right now)"
+  
+   session_data = dict(session_data)
+   session_data["recovering_indices"] = ",".join(indices)
+   session_data["shards_left"] = str(shards_left)
+  
+   message = f"""⏳ Still recovering: {shards_left} shards left{progress_text}.
+
+
+
+
+{active_percent:.1f}% of shards are active. OpenSearch is still copying replica shards for the new indices, so the status should return to GREEN on its own.
+
+
+
+
+Would you like me to keep waiting for GREEN? (Y/N)"""
+  
+   return {
+       "message": message,
+       "next_step": "wait_for_recovery",
+       "session_data": session_data
+   }
+
+
+
+
+def summarize_allocation_explain(explain):
+   """Reduce one allocation-explain response to a (decider, reason) key and an explanation"""
+   if "error" in explain:
+       error = explain["error"]
+       error_type = error.get("type", "unknown") if isinstance(error, dict) else str(error)
+       return ("explain_failed", error_type), "The allocation explain call itself failed."
+  
+   reason = explain.get("unassigned_info", {}).get("reason", "UNKNOWN")
+  
+   # Use the first decider that said NO; with no deciders the shard has no valid copy to allocate
+   for node in explain.get("node_allocation_decisions", []):
+       for decider in node.get("deciders", []):
+           if decider.get("decision") == "NO":
+               return (decider.get("decider", "unknown"), reason), decider.get("explanation", "")
+  
+   decision = explain.get("can_allocate", "unknown")
+   return (decision, reason), explain.get("allocate_explanation", "")
+
+
+
+
+explain_pool = ThreadPoolExecutor(max_workers=EXPLAIN_POOL_WORKERS, thread_name_prefix="explain")
+explain_slots = {}
+_explain_slots_lock = threading.Lock()
+
+
+
+
+def get_explain_slots(domain_endpoint):
+   """Get the semaphore capping in-flight explain calls against one cluster"""
+   with _explain_slots_lock:
+       return explain_slots.setdefault(domain_endpoint, threading.BoundedSemaphore(EXPLAIN_MAX_CONCURRENCY))
+
+
+
+
+@profile_checkpoint
+def explain_unassigned_primaries(domain_endpoint, context):
+   """Run allocation-explain for all unassigned primaries concurrently and group the answers"""
+   shards = get_unassigned_primaries(domain_endpoint)
+   to_explain = shards[:EXPLAIN_MAX_SHARDS]
+   budget = get_time_budget_seconds(context, EXPLAIN_MAX_SECONDS)
+   deadline = time.monotonic() + budget
+  
+   groups = {}
+   explained = 0
+   failed = 0
+   futures = {}
+   slots = get_explain_slots(domain_endpoint)
+  
+   # Submit only as fast as this cluster's slots free up, and stop submitting at the deadline
+   for index, shard in to_explain:
+       if not slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+           break
+       call_timeout = max(deadline - time.monotonic(), 1)
+       future = explain_pool.submit(explain_shard_allocation, domain_endpoint, index, shard, call_timeout)
+       future.add_done_callback(lambda _: slots.release())
+       futures[future] = (index, shard)
+  
+   done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+   # Calls already running end on their own timeout; queued ones are dropped (which frees their slot)
+   for future in not_done:
+       future.cancel()
+  
+   for future in done:
+       index, shard = futures[future]
+       try:
+           key, explanation = summarize_allocation_explain(future.result())
+       except Exception as e:
+           print(f"DEBUG - Allocation explain for {index}[{shard}] failed: {str(e)}")
+           key = ("explain_failed", type(e).__name__)
+       # A failed explain call tells us nothing about the shard, so it isn't counted as explained
+       if key[0] == "explain_failed":
+           failed += 1
+           continue
+       group = groups.setdefault(key, {"count": 0, "shards": [], "explanation": explanation})
+       group["count"] += 1
+       if len(group["shards"]) < 3:
+           group["shards"].append(f"{index}[{shard}]")
+       explained += 1
+  
+   return {
+       "total": len(shards),
+       "capped": len(shards) - len(to_explain),
+       "explained": explained,
+       "failed": failed,
+       "groups": sorted(groups.items(), key=lambda item: item[1]["count"], reverse=True)
+   }
+
+
+
+
+def handle_troubleshooting_steps(step, user_response, session_data, domain_endpoint, context=None):
    """Handle the step-by-step troubleshooting process"""
    cluster_name = session_data["cluster_name"]
   
@@ -402,40 +955,39 @@ This high resource usage is likely causing your yellow cluster status."""
   
    elif step == "check_replica_config":
        if user_response in ["y", "yes", "yeah", "yep", "1"]:
-           indices = get_indices(domain_endpoint)
-           node_count = session_data.get("node_count", 0)
-          
-           # Fix: Ensure we only process valid integer replica counts
-           replica_counts = []
-           for idx in indices:
-               if "rep" in idx and idx["rep"]:
-                   try:
-                       rep_count = int(idx["rep"])
-                       replica_counts.append(rep_count)
-                   except (ValueError, TypeError):
-                       # Skip invalid replica values
-                       continue
+           node_count = int(session_data.get("node_count", 0))
+           settings_index = get_index_settings_index(domain_endpoint)
+           max_replica_count = settings_index.max_replicas()
           
-           max_replica_count = max(replica_counts) if replica_counts else 0
-          
-           if max_replica_count >= int(node_count):
+           if max_replica_count >= node_count:
+               misconfigured_count, sample = settings_index.indices_needing_more_nodes(node_count, REPLICA_REPORT_MAX_INDICES)
+               unplaceable = settings_index.unplaceable_replica_shards(node_count)
+               index_lines = "\n".join(f"  • {name}: {replicas} replicas" for name, replicas in sample)
+               more_text = f"\n  ...and {misconfigured_count - len(sample)} more" if misconfigured_count > len(sample) else ""
+              
                message = f"""⚙️ Replica configuration issue found!
 
 
 
 
-Problem: You have indices with {max_replica_count} replicas, but only {node_count} nodes.
+Problem: {misconfigured_count} indices need more nodes than the {node_count} you have (up to {max_replica_count} replicas). {unplaceable} replica shards can't be placed.
+
+
+
 
+Indices with too many replicas:
+{index_lines}{more_text}
 
 
 
-Why this causes YELLOW: Replicas can't be allocated because there aren't enough nodes to place them on.
+
+Why this causes YELLOW: Replicas can't be allocated because there aren't enough nodes to place them on. Each copy of a shard needs its own node.
 
 
 
 
 Solutions:
-1. Reduce replica count: PUT _all/_settings {{"index":{{"number_of_replicas":1}}}}
+1. Reduce replica count on these indices: PUT <index>/_settings {{"index":{{"number_of_replicas":{max(node_count - 1, 0)}}}}}
 2. Add more nodes to accommodate current replica settings
 
 
@@ -555,46 +1107,22 @@ Did you create any new indices recently? (Y/N)"""
   
    elif step == "confirm_new_index_creation":
        if user_response in ["y", "yes", "yeah", "yep", "1"]:
-           message = """✅ Recent index creation confirmed!
-
-
-
-
-This explains your yellow cluster status. When new indices are created:
-
-
-
-
-1. OpenSearch initially places primary shards
-2. Replica shards are then allocated across other nodes 
-3. During this process, the cluster shows YELLOW status
-4. Once replication completes, status returns to GREEN
-
-
-
-
-Solution: Wait 5-10 minutes for the replication to complete. The status should self-resolve.
-
-
-
-
-Monitor with: GET _cat/indices?v to see when all shards are allocated.
-
-
-
-
-This is normal behavior and not a cause for concern."""
-          
+           return check_recovery_progress(session_data, domain_endpoint, context)
+       else:
+           message = "✅ No recent index creation.\n\nLet's move to the final step: checking for other allocation issues.\n\nWould you like me to proceed? (Y/N)"
            return {
                "message": message,
-               "next_step": "complete",
+               "next_step": "check_allocation_issues",
                "session_data": session_data
            }
+  
+   elif step == "wait_for_recovery":
+       if user_response in ["y", "yes", "yeah", "yep", "1"]:
+           return check_recovery_progress(session_data, domain_endpoint, context)
        else:
-           message = "✅ No recent index creation.\n\nLet's move to the final step: checking for other allocation issues.\n\nWould you like me to proceed? (Y/N)"
            return {
-               "message": message,
-               "next_step": "check_allocation_issues",
+               "message": "No problem! Replication should finish on its own. Check again later with: GET _cluster/health",
+               "next_step": "complete",
                "session_data": session_data
            }
   
@@ -650,7 +1178,48 @@ If these steps don't resolve the issue, consider reviewing your cluster allocati
   
    elif step == "red_troubleshooting_confirm":
        if user_response in ["y", "yes", "yeah", "yep", "1"]:
-           message = """🚨 RED cluster emergency troubleshooting:
+           try:
+               result = explain_unassigned_primaries(domain_endpoint, context)
+           except (requests.RequestException, ValueError) as e:
+               # Overloaded RED clusters often fail _cat/shards; the emergency steps still matter most
+               print(f"DEBUG - Listing unassigned primaries failed: {str(e)}")
+               result = None
+          
+           if result is None:
+               diagnosis = "I couldn't list the unassigned primary shards (the cluster didn't answer _cat/shards).\nRun GET _cluster/allocation/explain to see why a primary shard is unassigned."
+           elif result["groups"]:
+               group_lines = []
+               for (decider, reason), group in result["groups"][:EXPLAIN_MAX_GROUPS]:
+                   examples = ", ".join(group["shards"])
+                   group_lines.append(f"  • {decider} / {reason}: {group['count']} primaries (e.g. {examples})\n    {group['explanation']}")
+               groups_text = "\n".join(group_lines)
+              
+               timed_out = result["total"] - result["capped"] - result["explained"] - result["failed"]
+               coverage_text = f"Explained {result['explained']} of {result['total']} unassigned primary shards"
+               notes = []
+               if result["capped"]:
+                   notes.append(f"{result['capped']} skipped, I explain at most {EXPLAIN_MAX_SHARDS} per check")
+               if result["failed"]:
+                   notes.append(f"{result['failed']} explain calls failed")
+               if timed_out:
+                   notes.append(f"{timed_out} not explained within the time limit")
+               if notes:
+                   coverage_text += f" ({'; '.join(notes)})"
+              
+               diagnosis = f"""{coverage_text}, grouped by allocation decider and unassigned reason:
+{groups_text}"""
+           elif result["total"]:
+               reason_text = f"{result['failed']} explain calls failed and none succeeded" if result["failed"] else "none could be explained within the time limit"
+               diagnosis = f"Found {result['total']} unassigned primary shards, but {reason_text}.\nRun GET _cluster/allocation/explain to inspect them one at a time."
+           else:
+               diagnosis = "No unassigned primary shards were found. The cluster may be recovering; run GET _cat/recovery?v to check."
+          
+           message = f"""🚨 RED cluster emergency troubleshooting:
+
+
+
+
+{diagnosis}
 
 
 
@@ -665,7 +1234,6 @@ IMMEDIATE ACTIONS:
 
 
 Critical diagnostic commands:
- GET _cluster/allocation/explain
  GET _cat/nodes?v
  GET _cat/recovery?v
 
@@ -701,6 +1269,104 @@ Consider contacting AWS support immediately if you're unsure about data recovery
 
 
 
+def format_profile_summary(profiler, snapshot, snapshot_bytes, peak_bytes, tag):
+   """Build a compact text summary: top functions by cumulative time and top allocating lines at the memory high"""
+   stats_stream = io.StringIO()
+   stats = pstats.Stats(profiler, stream=stats_stream)
+   stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+  
+   snapshot = snapshot.filter_traces([
+       tracemalloc.Filter(False, tracemalloc.__file__),
+       tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+   ])
+   allocation_lines = []
+   for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+       frame = stat.traceback[0]
+       allocation_lines.append(f"  {stat.size / 1024:.1f} KiB in {stat.count} blocks: {frame.filename}:{frame.lineno}")
+  
+   return "\n".join([
+       f"PROFILE - {tag} peak_memory={peak_bytes / 1024:.1f}KiB",
+       "Top functions (cumulative time):",
+       stats_stream.getvalue().strip(),
+       f"Top allocations by line at the highest checkpoint ({snapshot_bytes / 1024:.1f}KiB traced):",
+       "  (tracemalloc is process-wide: with concurrent requests, e.g. server.py, this includes their memory too)",
+       "\n".join(allocation_lines) or "  (none)",
+   ])
+
+
+
+
+def profile_invocation(handler):
+   """Wrap a sampled share of invocations in cProfile and tracemalloc (PROFILE_SAMPLE_RATE)"""
+   @functools.wraps(handler)
+   def wrapper(event, context):
+       if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+           return handler(event, context)
+      
+       # cProfile and tracemalloc are process-wide, so only one invocation is profiled at a time
+       if not _profile_lock.acquire(blocking=False):
+           return handler(event, context)
+      
+       try:
+           session_attrs = event.get("sessionState", {}).get("sessionAttributes", {}) or {}
+           step = session_attrs.get("step", "initial")
+           cluster_name = session_attrs.get("cluster_name")
+           if not cluster_name:
+               slots = event.get("sessionState", {}).get("intent", {}).get("slots", {}) or {}
+               cluster_slot = (slots.get("ClusterName") or {}).get("value", {})
+               cluster_name = cluster_slot.get("interpretedValue") if isinstance(cluster_slot, dict) else cluster_slot
+          
+           profiler = cProfile.Profile()
+           tracemalloc.start()
+           with _profile_peak_lock:
+               _profile_peak.update(thread=threading.get_ident(), profiler=profiler, size=0, snapshot=None, overhead_ms=0.0)
+           start = time.perf_counter()
+           profiler.enable()
+           try:
+               result = handler(event, context)
+           finally:
+               profiler.disable()
+               elapsed_ms = (time.perf_counter() - start) * 1000
+               with _profile_peak_lock:
+                   _profile_peak.update(thread=None, profiler=None)
+                   current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                   # Fall back to the end state if no checkpoint saw more memory than is held now
+                   if _profile_peak["snapshot"] is None or current_bytes > _profile_peak["size"]:
+                       _profile_peak.update(size=current_bytes, snapshot=tracemalloc.take_snapshot())
+                   snapshot, snapshot_bytes = _profile_peak["snapshot"], _profile_peak["size"]
+                   overhead_ms = _profile_peak["overhead_ms"]
+                   _profile_peak["snapshot"] = None
+               tracemalloc.stop()
+          
+           # Reporting must never fail the request it is profiling
+           try:
+               # Snapshot time is excluded from wall_ms; cProfile's own overhead is not
+               tag = f"cluster={cluster_name} step={step} wall_ms={elapsed_ms - overhead_ms:.1f} snapshot_ms={overhead_ms:.1f}"
+               summary = format_profile_summary(profiler, snapshot, snapshot_bytes, peak_bytes, tag)
+               print(summary)
+              
+               if PROFILE_OUTPUT_DIR:
+                   # Both values come from the client, so only filename-safe characters are kept
+                   safe_cluster = re.sub(r"[^A-Za-z0-9_.-]", "_", str(cluster_name))[:64]
+                   safe_step = re.sub(r"[^A-Za-z0-9_.-]", "_", str(step))[:64]
+                   base_name = f"profile-{safe_cluster}-{safe_step}-{int(time.time() * 1000)}"
+                   base_path = os.path.join(PROFILE_OUTPUT_DIR, base_name)
+                   profiler.dump_stats(f"{base_path}.prof")
+                   with open(f"{base_path}.txt", "w") as summary_file:
+                       summary_file.write(summary)
+           except Exception as e:
+               print(f"ERROR: Profile reporting failed: {str(e)}")
+          
+           return result
+       finally:
+           _profile_lock.release()
+  
+   return wrapper
+
+
+
+
+@profile_invocation
 def lambda_handler(event, context):
    try:
        print("DEBUG - Full event:", json.dumps(event, indent=2))
@@ -748,7 +1414,8 @@ def lambda_handler(event, context):
                current_step,
                user_response,
                session_attrs,
-               domain_endpoint
+               domain_endpoint,
+               context
            )
       
        # Prepare response based on whether conversation continues or ends
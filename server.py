@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+
+
+
+# Each server process keeps one handler pool; main.http_session is shared by all of its threads
+HANDLER_WORKERS = int(os.environ.get("HANDLER_WORKERS", "32"))
+REQUEST_TIMEOUT_SECONDS = int(os.environ.get("REQUEST_TIMEOUT_SECONDS", "30"))
+MAX_BODY_BYTES = 1024 * 1024
+
+handler_pool = ThreadPoolExecutor(max_workers=HANDLER_WORKERS, thread_name_prefix="diagnosis")
+main.configure_http_pool(HANDLER_WORKERS)
+
+
+
+
+class RequestContext:
+   """Stands in for the Lambda context so time budgets work the same outside Lambda"""
+
+   def __init__(self, timeout_seconds):
+      self.deadline = time.monotonic() + timeout_seconds
+
+   def get_remaining_time_in_millis(self):
+      return max(int((self.deadline - time.monotonic()) * 1000), 0)
+
+
+
+
+async def send_json(send, status, body):
+   payload = json.dumps(body).encode()
+   await send({
+      "type": "http.response.start",
+      "status": status,
+      "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+   })
+   await send({"type": "http.response.body", "body": payload})
+
+
+
+
+async def read_body(receive):
+   """Read the full request body, returning None if it is larger than MAX_BODY_BYTES"""
+   chunks = []
+   size = 0
+   while True:
+      message = await receive()
+      chunk = message.get("body", b"")
+      size += len(chunk)
+      if size > MAX_BODY_BYTES:
+         return None
+      chunks.append(chunk)
+      if not message.get("more_body", False):
+         return b"".join(chunks)
+
+
+
+
+async def handle_lifespan(receive, send):
+   while True:
+      message = await receive()
+      if message["type"] == "lifespan.startup":
+         await send({"type": "lifespan.startup.complete"})
+      elif message["type"] == "lifespan.shutdown":
+         handler_pool.shutdown(wait=True)
+         await send({"type": "lifespan.shutdown.complete"})
+         return
+
+
+
+
+async def app(scope, receive, send):
+   """ASGI app: POST a Lex V2 event to / and get the lambda_handler response back"""
+   if scope["type"] == "lifespan":
+      await handle_lifespan(receive, send)
+      return
+
+   path = scope["path"]
+   method = scope["method"]
+
+   if path == "/health":
+      await send_json(send, 200, {"status": "ok"})
+      return
+   if path != "/":
+      await send_json(send, 404, {"error": f"Unknown path '{path}'"})
+      return
+   if method != "POST":
+      await send_json(send, 405, {"error": "Use POST with a Lex V2 event as the JSON body"})
+      return
+
+   body = await read_body(receive)
+   if body is None:
+      await send_json(send, 413, {"error": f"Request body is larger than {MAX_BODY_BYTES} bytes"})
+      return
+   try:
+      event = json.loads(body)
+   except ValueError as e:
+      await send_json(send, 400, {"error": f"Invalid JSON: {str(e)}"})
+      return
+   if not isinstance(event, dict):
+      await send_json(send, 400, {"error": "Event must be a JSON object"})
+      return
+
+   # lambda_handler is blocking (requests), so it runs on the worker pool, not the event loop
+   loop = asyncio.get_running_loop()
+   context = RequestContext(REQUEST_TIMEOUT_SECONDS)
+   response = await loop.run_in_executor(handler_pool, main.lambda_handler, event, context)
+   await send_json(send, 200, response)
+
+
+
+
+def main_cli():
+   parser = argparse.ArgumentParser(description="Serve the diagnosis engine over HTTP (ASGI, run with uvicorn)")
+   parser.add_argument("--host", default="127.0.0.1")
+   parser.add_argument("--port", type=int, default=8080)
+   parser.add_argument("--processes", type=int, default=1, help="uvicorn worker processes, each with its own handler pool")
+   args = parser.parse_args()
+
+   try:
+      import uvicorn
+   except ImportError:
+      raise SystemExit("server.py needs uvicorn: pip install uvicorn")
+
+   uvicorn.run("server:app", host=args.host, port=args.port, workers=args.processes)
+
+
+
+
+if __name__ == "__main__":
+   main_cli()
@@ -0,0 +1,154 @@
+import os
+import time
+
+# main.py builds AWS4Auth at import time; no AWS calls are made in these tests
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+import pytest
+import requests
+
+import main
+
+
+
+
+NO_VALID_COPY = {
+   "unassigned_info": {"reason": "NODE_LEFT"},
+   "can_allocate": "no_valid_shard_copy",
+   "allocate_explanation": "cannot allocate because a previous copy of the primary shard existed",
+   "node_allocation_decisions": [{"node_name": "node-0", "node_decision": "no"}]
+}
+
+DISK_THRESHOLD = {
+   "unassigned_info": {"reason": "ALLOCATION_FAILED"},
+   "can_allocate": "no",
+   "node_allocation_decisions": [
+      {"node_name": "node-0", "deciders": [{"decider": "same_shard", "decision": "YES"}]},
+      {"node_name": "node-1", "deciders": [{"decider": "disk_threshold", "decision": "NO", "explanation": "the node is above the high watermark"}]}
+   ]
+}
+
+
+
+
+@pytest.fixture
+def red_cluster(monkeypatch, request):
+   """Unassigned primaries and explain answers served from memory; each test gets its own endpoint"""
+   cluster = {"endpoint": f"http://{request.node.name}", "shards": [], "answers": {}, "delays": {}}
+
+   def explain_shard_allocation(domain_endpoint, index, shard, timeout_seconds):
+      time.sleep(cluster["delays"].get(index, 0))
+      answer = cluster["answers"].get(index, NO_VALID_COPY)
+      if isinstance(answer, Exception):
+         raise answer
+      return answer
+
+   monkeypatch.setattr(main, "get_unassigned_primaries", lambda domain_endpoint: list(cluster["shards"]))
+   monkeypatch.setattr(main, "explain_shard_allocation", explain_shard_allocation)
+   return cluster
+
+
+
+
+def test_summarize_uses_first_no_decider():
+   key, explanation = main.summarize_allocation_explain(DISK_THRESHOLD)
+   assert key == ("disk_threshold", "ALLOCATION_FAILED")
+   assert explanation == "the node is above the high watermark"
+
+
+
+
+def test_summarize_falls_back_to_can_allocate():
+   key, explanation = main.summarize_allocation_explain(NO_VALID_COPY)
+   assert key == ("no_valid_shard_copy", "NODE_LEFT")
+   assert explanation.startswith("cannot allocate")
+
+
+
+
+def test_summarize_error_body():
+   key, _ = main.summarize_allocation_explain({"error": {"type": "illegal_argument_exception"}, "status": 400})
+   assert key == ("explain_failed", "illegal_argument_exception")
+
+
+
+
+def test_explain_groups_by_decider_and_reason(red_cluster):
+   red_cluster["shards"] = [(f"logs-{i}", 0) for i in range(5)]
+   red_cluster["answers"] = {"logs-0": DISK_THRESHOLD, "logs-1": DISK_THRESHOLD}
+   result = main.explain_unassigned_primaries(red_cluster["endpoint"], None)
+
+   assert result["explained"] == 5
+   groups = dict(result["groups"])
+   assert groups[("no_valid_shard_copy", "NODE_LEFT")]["count"] == 3
+   assert groups[("disk_threshold", "ALLOCATION_FAILED")]["count"] == 2
+   assert result["groups"][0][0] == ("no_valid_shard_copy", "NODE_LEFT")
+
+
+
+
+def test_explain_respects_shard_cap(red_cluster, monkeypatch):
+   monkeypatch.setattr(main, "EXPLAIN_MAX_SHARDS", 3)
+   red_cluster["shards"] = [(f"logs-{i}", 0) for i in range(5)]
+   result = main.explain_unassigned_primaries(red_cluster["endpoint"], None)
+
+   assert result["total"] == 5
+   assert result["capped"] == 2
+   assert result["explained"] == 3
+
+
+
+
+def test_explain_counts_failures_separately(red_cluster):
+   red_cluster["shards"] = [(f"logs-{i}", 0) for i in range(3)]
+   red_cluster["answers"] = {
+      "logs-0": requests.HTTPError("503 Server Error"),
+      "logs-1": {"error": {"type": "security_exception"}, "status": 403}
+   }
+   result = main.explain_unassigned_primaries(red_cluster["endpoint"], None)
+
+   assert result["explained"] == 1
+   assert result["failed"] == 2
+   assert all(key[0] != "explain_failed" for key, _ in result["groups"])
+
+
+
+
+def test_explain_stops_at_deadline(red_cluster, monkeypatch):
+   monkeypatch.setattr(main, "EXPLAIN_MAX_SECONDS", 1)
+   red_cluster["shards"] = [("fast", 0), ("slow", 0)]
+   red_cluster["delays"] = {"slow": 3}
+   start = time.monotonic()
+   result = main.explain_unassigned_primaries(red_cluster["endpoint"], None)
+
+   assert time.monotonic() - start < 2
+   assert result["explained"] == 1
+   assert result["failed"] == 0
+   # Neither capped nor failed: the reply reports it as not explained in time
+   assert result["total"] - result["capped"] - result["explained"] - result["failed"] == 1
+
+
+
+
+def test_red_step_keeps_emergency_advice_when_listing_fails(monkeypatch):
+   def failing_listing(domain_endpoint):
+      raise requests.HTTPError("503 Server Error: Service Unavailable")
+
+   monkeypatch.setattr(main, "get_unassigned_primaries", failing_listing)
+   result = main.handle_troubleshooting_steps("red_troubleshooting_confirm", "yes", {"cluster_name": "demo"}, "http://listing-fails")
+
+   assert result["next_step"] == "complete"
+   assert "IMMEDIATE ACTIONS" in result["message"]
+   assert "GET _cluster/allocation/explain" in result["message"]
+
+
+
+
+def test_red_step_reports_failed_explains(red_cluster):
+   red_cluster["shards"] = [("logs-0", 0), ("logs-1", 0)]
+   red_cluster["answers"] = {"logs-0": requests.HTTPError("503"), "logs-1": requests.HTTPError("503")}
+   result = main.handle_troubleshooting_steps("red_troubleshooting_confirm", "yes", {"cluster_name": "demo"}, red_cluster["endpoint"])
+
+   assert "Explained" not in result["message"]
+   assert "2 explain calls failed" in result["message"]
@@ -0,0 +1,145 @@
+import os
+
+# main.py builds AWS4Auth at import time; no AWS calls are made in these tests
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+import pytest
+
+import main
+
+
+
+
+def index_row(name, replicas, shards=1, uuid=None):
+   return {"index": name, "uuid": uuid or f"uuid-{name}", "pri": str(shards), "rep": str(replicas), "creation.date": "1700000000000"}
+
+
+
+
+@pytest.fixture
+def fake_cluster(monkeypatch):
+   """Feed refresh() from in-memory rows and a settable state version, counting listings"""
+   cluster = {"version": "state:1", "rows": [], "listings": 0}
+
+   def get_index_settings(domain_endpoint):
+      cluster["listings"] += 1
+      return list(cluster["rows"])
+
+   monkeypatch.setattr(main, "get_cluster_state_version", lambda domain_endpoint: cluster["version"])
+   monkeypatch.setattr(main, "get_index_settings", get_index_settings)
+   return cluster
+
+
+
+
+def test_add_and_remove_keep_buckets_in_sync():
+   settings_index = main.IndexSettingsIndex()
+   settings_index._add("a", (2, 5, None, "ua"))
+   settings_index._add("b", (2, 3, None, "ub"))
+   settings_index._add("c", (1, 4, None, "uc"))
+
+   assert settings_index.names_by_replicas == {2: {"a", "b"}, 1: {"c"}}
+   assert settings_index.primaries_by_replicas == {2: 8, 1: 4}
+
+   settings_index._remove("a")
+   assert settings_index.names_by_replicas[2] == {"b"}
+   assert settings_index.primaries_by_replicas[2] == 3
+
+   settings_index._remove("b")
+   assert 2 not in settings_index.names_by_replicas
+   assert 2 not in settings_index.primaries_by_replicas
+   assert settings_index.max_replicas() == 1
+
+
+
+
+def test_unplaceable_replica_shards():
+   settings_index = main.IndexSettingsIndex()
+   settings_index._add("ok", (1, 10, None, "u1"))
+   settings_index._add("two-over", (4, 3, None, "u2"))
+   settings_index._add("one-over", (3, 2, None, "u3"))
+
+   # With 3 nodes each shard fits 1 primary + 2 replicas
+   assert settings_index.unplaceable_replica_shards(3) == 3 * 2 + 2 * 1
+   assert settings_index.unplaceable_replica_shards(5) == 0
+
+   count, sample = settings_index.indices_needing_more_nodes(3, limit=1)
+   assert count == 2
+   assert sample == [("two-over", 4)]
+
+
+
+
+def test_refresh_applies_only_changes(fake_cluster):
+   fake_cluster["rows"] = [index_row("a", 1), index_row("b", 5), index_row("c", 2)]
+   settings_index = main.IndexSettingsIndex()
+   assert settings_index.refresh("endpoint") == 3
+   assert settings_index.max_replicas() == 5
+
+   fake_cluster["version"] = "state:2"
+   fake_cluster["rows"] = [index_row("a", 1), index_row("b", 1), index_row("d", 3)]
+   # b changed, c removed, d added
+   assert settings_index.refresh("endpoint") == 3
+   assert settings_index.names_by_replicas == {1: {"a", "b"}, 3: {"d"}}
+   assert settings_index.max_replicas() == 3
+
+
+
+
+def test_refresh_replaces_recreated_index(fake_cluster):
+   fake_cluster["rows"] = [index_row("a", 1, uuid="old")]
+   settings_index = main.IndexSettingsIndex()
+   settings_index.refresh("endpoint")
+
+   fake_cluster["version"] = "state:2"
+   fake_cluster["rows"] = [index_row("a", 1, uuid="new")]
+   assert settings_index.refresh("endpoint") == 1
+   assert settings_index.indices["a"][3] == "new"
+
+
+
+
+def test_refresh_skips_listing_when_version_unchanged(fake_cluster):
+   fake_cluster["rows"] = [index_row("a", 1)]
+   settings_index = main.IndexSettingsIndex()
+   settings_index.refresh("endpoint")
+   assert settings_index.refresh("endpoint") == 0
+   assert fake_cluster["listings"] == 1
+
+
+
+
+def test_refresh_relists_when_version_unreadable(fake_cluster):
+   fake_cluster["version"] = None
+   fake_cluster["rows"] = [index_row("a", 5)]
+   settings_index = main.IndexSettingsIndex()
+   settings_index.refresh("endpoint")
+   assert settings_index.state_version is None
+
+   fake_cluster["rows"] = [index_row("a", 1)]
+   assert settings_index.refresh("endpoint") == 1
+   assert settings_index.max_replicas() == 1
+   assert fake_cluster["listings"] == 2
+
+
+
+
+def test_refresh_skips_invalid_rows(fake_cluster):
+   fake_cluster["rows"] = [index_row("a", 1), {"index": "closed", "pri": "", "rep": ""}]
+   settings_index = main.IndexSettingsIndex()
+   assert settings_index.refresh("endpoint") == 1
+   assert "closed" not in settings_index.indices
+
+
+
+
+def test_cluster_state_version_error_is_none(monkeypatch):
+   class ForbiddenResponse:
+      status_code = 403
+
+      def json(self):
+         return {"error": {"type": "security_exception"}, "status": 403}
+
+   monkeypatch.setattr(main.http_session, "get", lambda url, auth: ForbiddenResponse())
+   assert main.get_cluster_state_version("endpoint") is None
@@ -0,0 +1,182 @@
+import os
+from urllib.parse import urlparse
+
+# main.py builds AWS4Auth at import time; no AWS calls are made in these tests
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+import pytest
+
+import main
+
+
+
+
+class FakeResponse:
+   def __init__(self, status_code, body):
+      self.status_code = status_code
+      self.body = body
+
+   def json(self):
+      return self.body
+
+
+
+
+class FakeContext:
+   def __init__(self, remaining_ms):
+      self.remaining_ms = remaining_ms
+
+   def get_remaining_time_in_millis(self):
+      return self.remaining_ms
+
+
+
+
+def yellow(unassigned=4, initializing=0):
+   return FakeResponse(408, {
+      "status": "yellow",
+      "timed_out": True,
+      "unassigned_shards": unassigned,
+      "initializing_shards": initializing,
+      "active_shards_percent_as_number": 90.0
+   })
+
+
+def green():
+   return FakeResponse(200, {"status": "green", "timed_out": False, "unassigned_shards": 0, "initializing_shards": 0})
+
+
+
+
+@pytest.fixture
+def health_api(monkeypatch):
+   """Answer health calls from a scripted list, recording each call; server-side waits use up fake time"""
+   api = {"responses": [], "calls": [], "now": 1000.0}
+
+   def get(url, auth=None, params=None, timeout=None):
+      params = params or {}
+      api["calls"].append({"path": urlparse(url).path, "params": params, "timeout": timeout})
+      if "timeout" in params:
+         api["now"] += int(params["timeout"].rstrip("s"))
+      return api["responses"].pop(0)
+
+   monkeypatch.setattr(main.http_session, "get", get)
+   monkeypatch.setattr(main.time, "monotonic", lambda: api["now"])
+   return api
+
+
+
+
+def session(**extra):
+   return {"cluster_name": "demo", "step": "confirm_new_index_creation", **extra}
+
+
+
+
+def test_green_indices_and_cluster_completes(health_api):
+   health_api["responses"] = [FakeResponse(200, {"indices": {"new": {"status": "yellow"}}}), green(), green()]
+   result = main.check_recovery_progress(session(), "http://x", None)
+
+   assert result["next_step"] == "complete"
+   assert "back to GREEN" in result["message"]
+   # Per-index wait first, then a cluster-level check before claiming the cluster is GREEN
+   assert health_api["calls"][1]["path"] == "/_cluster/health/new"
+   assert health_api["calls"][2]["path"] == "/_cluster/health"
+
+
+
+
+def test_green_indices_on_yellow_cluster_moves_on(health_api):
+   health_api["responses"] = [green(), yellow(unassigned=3)]
+   result = main.check_recovery_progress(session(recovering_indices="new"), "http://x", None)
+
+   assert result["next_step"] == "check_allocation_issues"
+   assert "back to GREEN" not in result["message"]
+
+
+
+
+def test_timed_out_returns_resumable_state(health_api):
+   health_api["responses"] = [yellow(unassigned=4, initializing=2)]
+   result = main.check_recovery_progress(session(recovering_indices="new"), "http://x", None)
+
+   assert result["next_step"] == "wait_for_recovery"
+   assert result["session_data"]["shards_left"] == "6"
+   assert result["session_data"]["recovering_indices"] == "new"
+   assert "6 shards left" in result["message"]
+
+
+
+
+def test_same_count_while_initializing_is_not_a_stall(health_api):
+   health_api["responses"] = [yellow(unassigned=0, initializing=2)]
+   result = main.check_recovery_progress(session(recovering_indices="new", shards_left="2"), "http://x", None)
+
+   assert result["next_step"] == "wait_for_recovery"
+
+
+
+
+def test_same_count_with_nothing_initializing_is_a_stall(health_api):
+   health_api["responses"] = [yellow(unassigned=2, initializing=0)]
+   result = main.check_recovery_progress(session(recovering_indices="new", shards_left="2"), "http://x", None)
+
+   assert result["next_step"] == "check_allocation_issues"
+   assert "not making progress" in result["message"]
+
+
+
+
+def test_deleted_index_relists_and_retries(health_api):
+   health_api["responses"] = [
+      FakeResponse(404, {"error": {"type": "index_not_found_exception"}, "status": 404}),
+      FakeResponse(200, {"indices": {"new": {"status": "yellow"}}}),
+      yellow(unassigned=1)
+   ]
+   result = main.check_recovery_progress(session(recovering_indices="gone,new"), "http://x", None)
+
+   assert result["next_step"] == "wait_for_recovery"
+   assert result["session_data"]["recovering_indices"] == "new"
+   assert health_api["calls"][2]["path"] == "/_cluster/health/new"
+
+
+
+
+def test_unreadable_health_moves_on(health_api):
+   health_api["responses"] = [
+      FakeResponse(403, {"status": 403}),
+      FakeResponse(200, {"indices": {}}),
+      FakeResponse(503, None)
+   ]
+   result = main.check_recovery_progress(session(recovering_indices="new"), "http://x", None)
+
+   assert result["next_step"] == "check_allocation_issues"
+   assert "couldn't read" in result["message"]
+
+
+
+
+def test_retry_shares_one_deadline(health_api):
+   health_api["responses"] = [
+      FakeResponse(404, {"status": 404}),
+      FakeResponse(200, {"indices": {"new": {"status": "yellow"}}}),
+      yellow()
+   ]
+   main.check_recovery_progress(session(recovering_indices="gone,new"), "http://x", FakeContext(60000))
+
+   waits = [int(call["params"]["timeout"].rstrip("s")) for call in health_api["calls"] if "timeout" in call["params"]]
+   assert sum(waits) <= main.WAIT_FOR_GREEN_MAX_SECONDS
+   assert all(call["timeout"] <= main.WAIT_FOR_GREEN_MAX_SECONDS for call in health_api["calls"])
+
+
+
+
+def test_wait_respects_lambda_budget(health_api):
+   health_api["responses"] = [yellow()]
+   main.check_recovery_progress(session(recovering_indices="new"), "http://x", FakeContext(10000))
+
+   # 10s left minus the 3s safety margin; the HTTP timeout may not run past that
+   call = health_api["calls"][0]
+   assert call["timeout"] <= 7
+   assert int(call["params"]["timeout"].rstrip("s")) <= 7 - main.HEALTH_RESPONSE_GRACE_SECONDS